@@ -0,0 +1,335 @@
+'''
+Columnar archive of finished games.
+
+An archive is a directory of flat, fixed-width column files:
+
+    meta.json     metadata table: name, winner and turn of each game
+    offsets.i64   n+1 row offsets; game i's moves are the rows
+                  offsets[i] to offsets[i+1] of the move columns
+    start.u8      start square of each move (y * 8 + x)
+    end.u8        end square of each move
+    movetype.u8   movetype of each move, as an index into MOVETYPES
+    player.u8     player of each move, as an index into PLAYERS
+    board.u8      final position of each game, 64 squares per game
+
+Archives are written from Move.asdict() and ChessBoard.asdoc() data.
+When an archive is opened its column files are memory-mapped, so
+reading and searching games neither copies the columns nor needs a
+database cursor.
+
+Usage:
+    python archive.py export ARCHIVE
+    python archive.py import ARCHIVE
+    python archive.py search ARCHIVE "41 43" "46 44"
+'''
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+from bisect import bisect_right
+from contextlib import ExitStack
+
+from chess import ChessBoard, GameMaster
+from common import Move
+from errors import VersionConflictError
+
+MOVETYPES = ('move', 'capture', 'pawncapture')
+PLAYERS = ('white', 'black')
+PIECES = ('king', 'queen', 'bishop', 'knight', 'rook', 'pawn')
+MOVED = 0x80  # set on board squares whose piece has moved
+
+MOVE_COLUMNS = ('start', 'end', 'movetype', 'player')
+FILES = {
+    'offsets': 'offsets.i64',
+    'start': 'start.u8',
+    'end': 'end.u8',
+    'movetype': 'movetype.u8',
+    'player': 'player.u8',
+    'board': 'board.u8',
+}
+
+
+
+def square(coord):
+    '''Encode an (x, y) coord as a square index 0-63.'''
+    return coord[1] * 8 + coord[0]
+
+def coord(sq):
+    '''Decode a square index 0-63 into an (x, y) coord.'''
+    return (sq % 8, sq // 8)
+
+def encode_board(doclist):
+    '''
+    Encode a board document list (from ChessBoard.asdoc())
+    as 64 bytes, one per square. Empty squares are 0.
+    '''
+    squares = bytearray(64)
+    for doc in doclist:
+        piece = doc['piece']
+        code = 1 + PLAYERS.index(piece['colour']) * len(PIECES) \
+            + PIECES.index(piece['name'])
+        if piece['moved']:
+            code |= MOVED
+        squares[square((doc['x'], doc['y']))] = code
+    return bytes(squares)
+
+def decode_board(squares):
+    '''Decode 64 board bytes into a board document list.'''
+    doclist = []
+    for sq, code in enumerate(squares):
+        if code == 0:
+            continue
+        colour, name = divmod((code & ~MOVED) - 1, len(PIECES))
+        x, y = coord(sq)
+        doclist.append(
+            {'x': x,
+             'y': y,
+             'piece': {'name': PIECES[name],
+                       'colour': PLAYERS[colour],
+                       'moved': bool(code & MOVED),
+                       },
+             }
+        )
+    return doclist
+
+
+def export_games(path, games):
+    '''
+    Write the finished games from an iterable of (board, game)
+    pairs to an archive at path.
+    Games without a winner are skipped.
+    Returns the number of games written.
+
+    The archive is written to a temporary directory next to path and
+    moved into place when complete, so open readers of an existing
+    archive keep their (unlinked) files, and a failed export leaves
+    the existing archive untouched.
+    '''
+    path = os.path.abspath(path)
+    parent, name = os.path.split(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f'.{name}.', dir=parent)
+    try:
+        os.chmod(tmp, 0o755)  # mkdtemp directories are private
+        count = _write_archive(tmp, games)
+        if os.path.exists(path):
+            # Directories cannot be replaced unless empty,
+            # so move the old archive aside first
+            old = tempfile.mkdtemp(prefix=f'.{name}.old.', dir=parent)
+            try:
+                os.replace(path, old)
+            except BaseException:
+                os.rmdir(old)
+                raise
+            try:
+                os.replace(tmp, path)
+            except BaseException:
+                os.replace(old, path)  # put the old archive back
+                raise
+            shutil.rmtree(old)
+        else:
+            os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return count
+
+def _write_archive(path, games):
+    '''Write the archive files into the empty directory at path.'''
+    meta = {'byteorder': sys.byteorder,
+            'names': [],
+            'winners': [],
+            'turns': [],
+            }
+    offsets = array('q', [0])
+    with ExitStack() as stack:
+        files = {col: stack.enter_context(open(os.path.join(path, FILES[col]), 'wb'))
+                 for col in MOVE_COLUMNS + ('board',)}
+        for board, game in games:
+            winner = board.winner()
+            if winner is None:
+                continue
+            moves = [move.asdict() for move in game.moves]
+            files['start'].write(bytes(square(m['start']) for m in moves))
+            files['end'].write(bytes(square(m['end']) for m in moves))
+            files['movetype'].write(bytes(MOVETYPES.index(m['movetype']) for m in moves))
+            files['player'].write(bytes(PLAYERS.index(m['player']) for m in moves))
+            files['board'].write(encode_board(board.asdoc()))
+            offsets.append(offsets[-1] + len(moves))
+            meta['names'].append(game.name)
+            meta['winners'].append(winner)
+            meta['turns'].append(game.turn)
+    with open(os.path.join(path, FILES['offsets']), 'wb') as f:
+        offsets.tofile(f)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return len(meta['names'])
+
+
+class Archive:
+    '''
+    Read-only view of an archive on disk.
+
+    Columns are exposed as memoryviews over memory-mapped files:
+    offsets (int64), start, end, movetype, player and board (uint8).
+    Use as a context manager, or call close() when done.
+    '''
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['byteorder'] != sys.byteorder:
+            raise ValueError(f'Archive byteorder is {meta["byteorder"]}, expected {sys.byteorder}')
+        self.names = meta['names']
+        self.winners = meta['winners']
+        self.turns = meta['turns']
+        self._maps = {}
+        for col, filename in FILES.items():
+            with open(os.path.join(path, filename), 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    # Empty files cannot be memory-mapped
+                    self._maps[col] = b''
+                else:
+                    self._maps[col] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self._maps['offsets']).cast('q')
+        self.start = memoryview(self._maps['start'])
+        self.end = memoryview(self._maps['end'])
+        self.movetype = memoryview(self._maps['movetype'])
+        self.player = memoryview(self._maps['player'])
+        self.board = memoryview(self._maps['board'])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.names)
+
+    def close(self):
+        '''
+        Release the column views and unmap the files.
+        Slices of the columns that are still held elsewhere
+        keep their file mapped until they are released.
+        '''
+        for col in ('offsets',) + MOVE_COLUMNS + ('board',):
+            getattr(self, col).release()
+        for mm in self._maps.values():
+            if isinstance(mm, mmap.mmap):
+                try:
+                    mm.close()
+                except BufferError:
+                    pass  # unmapped when the last slice is released
+        self._maps = {}
+
+    def moves(self, i):
+        '''Return the moves of game i as a list of Move objects.'''
+        return [Move(step=step,
+                     player=PLAYERS[self.player[row]],
+                     start=coord(self.start[row]),
+                     end=coord(self.end[row]),
+                     movetype=MOVETYPES[self.movetype[row]],
+                     )
+                for step, row in enumerate(range(self.offsets[i], self.offsets[i + 1]))]
+
+    def load(self, i):
+        '''
+        Return the final board and game objects of game i,
+        like DataStore.load().
+        game.version is 0, as for a newly inserted game.
+        '''
+        board = ChessBoard.fromdoc(decode_board(self.board[i * 64:(i + 1) * 64]))
+        game = GameMaster.fromdoc(
+            {'turn': self.turns[i],
+             'moves': [move.asdict() for move in self.moves(i)],
+             }
+        )
+        game.name = self.names[i]
+        game.version = 0
+        return board, game
+
+    def search(self, pattern):
+        '''
+        Return the indexes of games in which the moves in pattern,
+        a sequence of (start, end) coords, were played consecutively.
+        '''
+        if not pattern:
+            raise ValueError('pattern must contain at least one move')
+        starts = bytes(square(start) for start, end in pattern)
+        ends = bytes(square(end) for start, end in pattern)
+        # Scan the start column directly, then check the end column
+        # and that the match lies within a single game
+        column = self._maps['start']
+        found = []
+        pos = column.find(starts)
+        while pos != -1:
+            i = bisect_right(self.offsets, pos) - 1
+            stop = self.offsets[i + 1]
+            if pos + len(starts) <= stop and self.end[pos:pos + len(ends)] == ends:
+                found.append(i)
+                pos = column.find(starts, stop)
+            else:
+                pos = column.find(starts, pos + 1)
+        return found
+
+
+def import_games(archive, datastore):
+    '''
+    Save every game in archive to datastore, replacing
+    any stored game with the same name.
+    Games that another player saves while they are being
+    replaced are skipped.
+    Returns the number of games imported and the names
+    of the games skipped.
+    '''
+    count, skipped = 0, []
+    for i in range(len(archive)):
+        board, game = archive.load(i)
+        if not datastore.initgame(board, game):
+            try:
+                datastore.save(board, game)
+            except VersionConflictError:
+                skipped.append(game.name)
+                continue
+        count += 1
+    return count, skipped
+
+
+def parse_move(inputstr):
+    '''Parse a move such as "41 43" into (start, end) coords.'''
+    start, end = inputstr.split(' ')
+    return (int(start[0]), int(start[1])), (int(end[0]), int(end[1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('export', 'import', 'search'))
+    parser.add_argument('archive')
+    parser.add_argument('moves', nargs='*', help='moves to search for, e.g. "41 43"')
+    args = parser.parse_args(argv)
+
+    if args.command == 'search':
+        with Archive(args.archive) as archive:
+            for i in archive.search([parse_move(move) for move in args.moves]):
+                print(archive.names[i])
+        return
+
+    from main import DataStore, URI
+    datastore = DataStore(URI)
+    if args.command == 'export':
+        count = export_games(args.archive, datastore.games())
+        print(f'Exported {count} games to {args.archive}')
+    else:
+        with Archive(args.archive) as archive:
+            count, skipped = import_games(archive, datastore)
+        print(f'Imported {count} games from {args.archive}')
+        if skipped:
+            print(f'Skipped {len(skipped)} games changed during import: {", ".join(skipped)}')
+
+
+if __name__ == '__main__':
+    main()
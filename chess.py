@@ -30,15 +30,19 @@ class GameMaster:
     '''
     def __init__(self):
         self.turn = None
+        self.moves = []
 
     @classmethod
     def fromdoc(cls, doc):
         game = cls()
         game.turn = doc['turn']
+        game.moves = [Move.fromdict(movedict) for movedict in doc.get('moves', [])]
         return game
     
     def asdoc(self):
-        return {'turn': self.turn}
+        return {'turn': self.turn,
+                'moves': [move.asdict() for move in self.moves],
+                }
 
     @staticmethod
     def format_move(start, end, movetype):
@@ -46,6 +50,12 @@ class GameMaster:
 
     def newgame(self):
         self.turn = 'white'
+        self.moves = []
+
+    def record(self, move):
+        '''Add move to the game's move history.'''
+        move.step = len(self.moves)
+        self.moves.append(move)
     
     def get_player_move(self, inputstr, **kwargs):
         '''
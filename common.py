@@ -33,5 +33,5 @@ class Move:
 
     @classmethod
     def fromdict(cls, movedict):
-        return cls(movedict['step'], movedict)
+        return cls(**movedict)
 
@@ -45,3 +45,18 @@ class UndoError(Exception):
         self.msg = msg
 
         super().__init__(f'{self.msg}')
+
+class VersionConflictError(Exception):
+    def __init__(self, label, version, msg):
+        self.label = label
+        self.version = version
+        self.msg = msg
+
+        super().__init__(f'{label} (version {version}): {self.msg}')
+
+class GameNotFoundError(Exception):
+    def __init__(self, label, msg):
+        self.label = label
+        self.msg = msg
+
+        super().__init__(f'{label}: {self.msg}')
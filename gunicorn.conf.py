@@ -0,0 +1,20 @@
+# gunicorn settings for the chess web app
+# gunicorn -c gunicorn.conf.py -w 4 'main:create_app({"WARMUP": True})'
+
+def post_worker_init(worker):
+    '''
+    Connect a newly forked worker to the database before it
+    accepts requests, if the app was created with WARMUP.
+
+    Forked workers never inherit a database connection, so with
+    --preload the connection made by create_app() in the master
+    is not available to them.
+    '''
+    app = worker.wsgi
+    datastore = app.extensions.get('datastore')
+    if app.config.get('WARMUP') and hasattr(datastore, 'warmup'):
+        try:
+            datastore.warmup()
+        except Exception:
+            # The first request will connect instead
+            worker.log.exception('Database warm-up failed')
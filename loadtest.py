@@ -0,0 +1,421 @@
+'''
+Load generator for the chess web app.
+
+Simulates players running /newgame -> repeated /play POSTs -> /load
+against the app, either in-process through Flask's test client or
+against a running server over HTTP, and reports throughput and
+p50/p95/p99 latency per endpoint.
+
+Usage:
+    python loadtest.py --players 200 --concurrency 16 --moves 10
+    python loadtest.py --url https://chess.example.com --mix full=8,resume=1,watch=1
+    python loadtest.py --startup --uri mongodb://localhost/chess
+
+When run in-process, the app is created with MemoryStore in place
+of DataStore so that no database is needed, unless --uri is given.
+
+--startup times app creation and the first request that reads from
+the database, with and without WARMUP, instead of running players.
+Each run is made in a fresh process, which also forks once to time
+the first request of a worker, as in a pre-fork server.
+
+Moves that the app rejects are counted separately from HTTP errors.
+'''
+import argparse
+import copy
+import http.client
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+from chess import ChessBoard, GameMaster
+from errors import VersionConflictError, GameNotFoundError
+
+## Scripted move sequences
+# Each script is a list of legal moves, alternating white and black,
+# starting from the initial position. The moves from LOOPS[name]
+# onwards return to the position they started from, so they are
+# repeated for as long as needed.
+SCRIPTS = {
+    'knights': ['10 22', '17 25', '22 10', '25 17',
+                '60 52', '67 55', '52 60', '55 67'],
+    'pawns': ['41 43', '46 44', '31 32', '36 35',
+              '60 52', '67 55', '52 60', '55 67'],
+}
+LOOPS = {'knights': 0, 'pawns': 4}
+
+## Session kinds
+# full:   /newgame -> /play POSTs -> /load
+# resume: /load -> /play POSTs
+# watch:  /load -> /play GETs
+KINDS = ('full', 'resume', 'watch')
+DEFAULT_MIX = 'full=1'
+
+
+
+class MemoryStore:
+    '''
+    In-memory stand-in for DataStore.
+    Documents follow the same ER model as the database,
+    including compare-and-swap saves on game.version.
+    '''
+    def __init__(self):
+        self.docs = {}
+        self.lock = threading.Lock()
+
+    def load(self, label):
+        with self.lock:
+            if label not in self.docs:
+                raise GameNotFoundError(label, 'No such game')
+            doc = copy.deepcopy(self.docs[label])
+        board = ChessBoard.fromdoc(doc['board']['position'])
+        game = GameMaster.fromdoc(doc['game'])
+        game.name = label
+        game.version = doc['game']['version']
+        return board, game
+
+    def save(self, board, game):
+        doc = {'game': {'name': game.name,
+                        'version': game.version + 1,
+                        **game.asdoc()},
+               'board': {'position': board.asdoc()},
+               }
+        with self.lock:
+            stored = self.docs.get(game.name)
+            if stored is None or stored['game']['version'] != game.version:
+                raise VersionConflictError(game.name, game.version,
+                                           'Game was changed by another player')
+            self.docs[game.name] = doc
+        game.version += 1
+
+    def games(self):
+        with self.lock:
+            labels = list(self.docs)
+        for label in labels:
+            yield self.load(label)
+
+    def initgame(self, board, game):
+        with self.lock:
+            stored = self.docs.get(game.name)
+            if stored is None:
+                self.docs[game.name] = {
+                    'game': {'name': game.name, 'version': 0, **game.asdoc()},
+                    'board': {'position': board.asdoc()},
+                }
+                game.version = 0
+                return True
+            game.version = stored['game']['version']
+            return False
+
+
+
+class TestClientTarget:
+    '''Drives the app in-process through Flask's test client.'''
+    def __init__(self, app):
+        self.app = app
+
+    @contextmanager
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, params=None, form=None):
+            if method == 'GET':
+                resp = client.get(path, query_string=params)
+            else:
+                resp = client.post(path, query_string=params, data=form)
+            return resp.status_code, resp.get_data()
+        yield send
+
+
+class HTTPTarget:
+    '''Drives a running server over HTTP(S) (redirects are not followed).'''
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        if parts.scheme == 'https':
+            self.connection = http.client.HTTPSConnection
+            self.port = parts.port or 443
+        else:
+            self.connection = http.client.HTTPConnection
+            self.port = parts.port or 80
+
+    @contextmanager
+    def session(self):
+        conn = self.connection(self.host, self.port, timeout=30)
+
+        def send(method, path, params=None, form=None):
+            if params:
+                path = f'{path}?{urlencode(params)}'
+            body, headers = None, {}
+            if form is not None:
+                body = urlencode(form)
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            return resp.status, resp.read()
+        try:
+            yield send
+        finally:
+            conn.close()
+
+
+
+class Recorder:
+    '''Collects per-endpoint latency samples and outcome counts.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.rejected = {}
+
+    def record(self, endpoint, elapsed, status, body):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(elapsed)
+            if status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            elif b'class="error"' in body:
+                self.rejected[endpoint] = self.rejected.get(endpoint, 0) + 1
+
+    def report(self, duration):
+        lines = [f'{"endpoint":<14}{"count":>8}{"errors":>8}{"rejected":>10}'
+                 f'{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}']
+        total = 0
+        for endpoint in sorted(self.samples):
+            samples = sorted(self.samples[endpoint])
+            total += len(samples)
+            lines.append(
+                f'{endpoint:<14}{len(samples):>8}'
+                f'{self.errors.get(endpoint, 0):>8}'
+                f'{self.rejected.get(endpoint, 0):>10}'
+                f'{len(samples) / duration:>10.1f}'
+                f'{percentile(samples, 50) * 1000:>10.2f}'
+                f'{percentile(samples, 95) * 1000:>10.2f}'
+                f'{percentile(samples, 99) * 1000:>10.2f}'
+            )
+        lines.append(f'{total} requests in {duration:.2f}s '
+                     f'({total / duration:.1f} req/s)')
+        return '\n'.join(lines)
+
+
+def percentile(samples, pct):
+    '''
+    Return the pct-th percentile of sorted samples (nearest rank).
+    Returns 0 if there are no samples.
+    '''
+    if not samples:
+        return 0
+    rank = max(1, -(-len(samples) * pct // 100))
+    return samples[int(rank) - 1]
+
+
+def parse_mix(mixstr):
+    '''
+    Parse a mix string such as "full=8,resume=1,watch=1"
+    into a dict of session kind -> weight.
+    '''
+    mix = {}
+    for item in mixstr.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in KINDS:
+            raise ValueError(f'Unknown session kind {kind!r}, expected one of {KINDS}')
+        mix[kind] = float(weight) if weight else 1.0
+    return mix
+
+
+def script_moves(name, count):
+    '''
+    Return the first count moves of the named script,
+    repeating its loop after the last move.
+    '''
+    script, loop = SCRIPTS[name], LOOPS[name]
+    return [script[i if i < loop else loop + (i - loop) % (len(script) - loop)]
+            for i in range(count)]
+
+
+def run_player(target, recorder, label, kind, script, moves):
+    '''Run one player session of the given kind.'''
+    with target.session() as send:
+        def timed(endpoint, method, path, **kwargs):
+            start = time.perf_counter()
+            status, body = send(method, path, **kwargs)
+            recorder.record(endpoint, time.perf_counter() - start, status, body)
+
+        if kind == 'full':
+            timed('GET /newgame', 'GET', '/newgame', params={'game': label})
+        else:
+            timed('GET /load', 'GET', '/load', params={'game': label})
+        for move in script_moves(script, moves):
+            if kind == 'watch':
+                timed('GET /play', 'GET', '/play', params={'game': label})
+            else:
+                timed('POST /play', 'POST', '/play', params={'game': label},
+                      form={'player_input': move})
+        if kind == 'full':
+            timed('GET /load', 'GET', '/load', params={'game': label})
+
+
+def plan(players, mix, scripts, seed=None):
+    '''
+    Return a (label, kind, script) tuple for each player.
+    Each player picks a session kind by mix weight and a script at random.
+    '''
+    rng = random.Random(seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=players)
+    return [(f'loadtest-{i}', kind, rng.choice(scripts))
+            for i, kind in enumerate(kinds)]
+
+
+def prepare_games(target, players):
+    '''
+    Start a game (untimed) for each resume/watch player,
+    so that they have data to load.
+    '''
+    with target.session() as send:
+        for label, kind, script in players:
+            if kind != 'full':
+                send('GET', '/newgame', params={'game': label})
+
+
+def run(target, players, concurrency, moves):
+    '''Run the planned player sessions and return (recorder, duration).'''
+    recorder = Recorder()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(run_player, target, recorder,
+                               label, kind, script, moves)
+                   for label, kind, script in players]
+        for future in futures:
+            future.result()
+    return recorder, time.perf_counter() - start
+
+
+def time_startup(config, label='loadtest-startup'):
+    '''
+    Return (create, first, forked): seconds taken to create the app
+    with config, seconds taken by its first database read, and
+    seconds taken by the first database read in a forked worker.
+    '''
+    from main import create_app
+    start = time.perf_counter()
+    app = create_app(config)
+    created = time.perf_counter()
+    app.test_client().get('/load', query_string={'game': label})
+    first = time.perf_counter()
+    forked = time_forked(app, label)
+    app.extensions['datastore'].close()
+    return created - start, first - created, forked
+
+
+def time_forked(app, label):
+    '''
+    Fork, and return seconds taken by the first database read in
+    the child. The child is warmed up first if the app was created
+    with WARMUP, as gunicorn.conf.py does for each worker.
+    '''
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            if app.config['WARMUP']:
+                app.extensions['datastore'].warmup()
+            start = time.perf_counter()
+            app.test_client().get('/load', query_string={'game': label})
+            os.write(write, repr(time.perf_counter() - start).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        result = f.read()
+    os.waitpid(pid, 0)
+    if not result:
+        raise RuntimeError('Forked worker failed to report its timing')
+    return float(result)
+
+
+def startup_report(uri, repeat):
+    '''
+    Time startup with and without WARMUP, repeat times each,
+    in fresh processes so that neither run reuses the other's
+    imports or connections. Returns the report of median times.
+    '''
+    lines = [f'{"WARMUP":<8}{"create ms":>12}{"first ms":>12}'
+             f'{"total ms":>12}{"worker ms":>12}']
+    for warmup in (False, True):
+        runs = []
+        for _ in range(repeat):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__),
+                 '--uri', uri, '--startup-run', str(int(warmup))],
+                capture_output=True, text=True, check=True)
+            runs.append(json.loads(proc.stdout))
+        create, first, forked = (statistics.median(times) for times in zip(*runs))
+        lines.append(f'{str(warmup):<8}{create * 1000:>12.2f}{first * 1000:>12.2f}'
+                     f'{(create + first) * 1000:>12.2f}{forked * 1000:>12.2f}')
+    lines.append(f'median of {repeat} runs each; worker ms is the first '
+                 f'request of a forked worker')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='drive a running server instead of the test client')
+    parser.add_argument('--uri', help='database URI for the in-process app (default: MemoryStore)')
+    parser.add_argument('--startup', action='store_true',
+                        help='time app startup with and without WARMUP (needs --uri)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of --startup runs of each kind')
+    parser.add_argument('--startup-run', type=int, choices=(0, 1), help=argparse.SUPPRESS)
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--moves', type=int, default=8,
+                        help='number of /play requests per player')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='session kind weights, e.g. full=8,resume=1,watch=1')
+    parser.add_argument('--script', action='append', choices=sorted(SCRIPTS),
+                        help='move script(s) to use (default: all)')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    if args.url and (args.uri or args.startup):
+        parser.error('--uri and --startup apply to the in-process app, not --url')
+    if args.startup and not args.uri:
+        parser.error('--startup needs --uri; MemoryStore has no connection to time')
+
+    def storeconfig():
+        if args.uri:
+            return {'URI': args.uri}
+        return {'DATASTORE': MemoryStore()}
+
+    if args.startup_run is not None:
+        # One run of --startup, in its own process
+        print(json.dumps(time_startup({'URI': args.uri,
+                                       'WARMUP': bool(args.startup_run)})))
+        return
+    if args.startup:
+        print(startup_report(args.uri, args.repeat))
+        return
+
+    players = plan(args.players, parse_mix(args.mix),
+                   args.script or sorted(SCRIPTS), args.seed)
+    if args.url:
+        target = HTTPTarget(args.url)
+    else:
+        from main import create_app
+        target = TestClientTarget(create_app(storeconfig()))
+    prepare_games(target, players)
+
+    recorder, duration = run(target, players, args.concurrency, args.moves)
+    print(recorder.report(duration))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from archive import Archive, export_games, import_games, parse_move
+from chess import ChessBoard, GameMaster
+from loadtest import MemoryStore
+
+# White captures the black king on the fifth move
+FINISHED = ['41 43', '56 55', '30 74', '66 64', '74 47']
+
+
+def play(label, moves):
+    board = ChessBoard()
+    game = GameMaster()
+    board.newgame()
+    game.newgame()
+    game.name = label
+    for inputstr in moves:
+        move = game.get_player_move(inputstr, board=board)
+        board.update(move)
+        game.record(move)
+        game.next_turn()
+    return board, game
+
+
+def square(doc):
+    return doc['x'], doc['y']
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'archive')
+    export_games(path, [play('g0', FINISHED),
+                        play('unfinished', FINISHED[:2]),
+                        play('g1', FINISHED)])
+    return path
+
+
+def test_export_load_round_trip(path):
+    board, game = play('g0', FINISHED)
+    with Archive(path) as archive:
+        assert archive.names == ['g0', 'g1']
+        assert archive.winners == ['white', 'white']
+        loaded_board, loaded_game = archive.load(0)
+    assert sorted(loaded_board.asdoc(), key=square) == sorted(board.asdoc(), key=square)
+    assert loaded_game.asdoc() == game.asdoc()
+    assert (loaded_game.name, loaded_game.version) == ('g0', 0)
+
+
+def test_search(path):
+    with Archive(path) as archive:
+        assert archive.search([parse_move('30 74'), parse_move('66 64')]) == [0, 1]
+        # The last move of g0 followed by the first move of g1
+        assert archive.search([parse_move('74 47'), parse_move('41 43')]) == []
+        with pytest.raises(ValueError):
+            archive.search([])
+
+
+def test_close_with_live_slice(path):
+    archive = Archive(path)
+    squares = archive.board[:64]
+    archive.close()
+    assert len(bytes(squares)) == 64
+    squares.release()
+
+
+def test_failed_export_keeps_old_archive(path, monkeypatch):
+    replace = os.replace
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(src)
+        if len(calls) == 2:  # moving the new archive into place
+            raise OSError('replace failed')
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError):
+        export_games(path, [play('new', FINISHED)])
+    monkeypatch.undo()
+    with Archive(path) as archive:
+        assert archive.names == ['g0', 'g1']
+    assert os.listdir(os.path.dirname(path)) == ['archive']
+
+
+def test_import_skips_conflicting_games(path):
+    class BusyStore(MemoryStore):
+        def save(self, board, game):
+            # Another player saves first
+            self.docs[game.name]['game']['version'] += 1
+            super().save(board, game)
+
+    datastore = BusyStore()
+    datastore.initgame(*play('g1', []))
+    with Archive(path) as archive:
+        assert import_games(archive, datastore) == (1, ['g1'])
+    assert datastore.load('g0')[1].moves[-1].end == (4, 7)
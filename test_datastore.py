@@ -0,0 +1,89 @@
+import pytest
+
+from chess import ChessBoard, GameMaster
+from errors import VersionConflictError, GameNotFoundError
+from loadtest import MemoryStore
+from main import DataStore
+
+
+@pytest.fixture
+def datastore(monkeypatch):
+    mongomock = pytest.importorskip('mongomock')
+    import pymongo
+    monkeypatch.setattr(pymongo, 'MongoClient', mongomock.MongoClient)
+    datastore = DataStore('mongodb://localhost/chess', 'games')
+    datastore.ensure_indexes()
+    yield datastore
+    datastore.close()
+
+
+@pytest.fixture(params=['memory', 'mongo'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryStore()
+    return request.getfixturevalue('datastore')
+
+
+def newgame(store, label):
+    board = ChessBoard()
+    game = GameMaster()
+    board.newgame()
+    game.newgame()
+    game.name = label
+    store.initgame(board, game)
+    return board, game
+
+
+def test_initgame_only_inserts_once(store):
+    board, game = newgame(store, 'g')
+    store.save(board, game)
+    assert not store.initgame(board, game)
+    assert game.version == 1
+
+
+def test_save_conflict_between_loaded_copies(store):
+    newgame(store, 'g')
+    board1, game1 = store.load('g')
+    board2, game2 = store.load('g')
+    store.save(board1, game1)
+    with pytest.raises(VersionConflictError):
+        store.save(board2, game2)
+    assert store.load('g')[1].version == 1
+
+
+def test_load_unknown_game(store):
+    with pytest.raises(GameNotFoundError):
+        store.load('missing')
+
+
+def test_load_legacy_document_without_version(datastore):
+    board, game = ChessBoard(), GameMaster()
+    board.newgame()
+    game.newgame()
+    datastore.collection.insert_one(
+        {'game': {'name': 'legacy', **game.asdoc()},
+         'board': {'position': board.asdoc()}})
+    board, game = datastore.load('legacy')
+    assert game.version == 0
+    datastore.save(board, game)
+    assert datastore.collection.find_one({'game.name': 'legacy'})['game']['version'] == 1
+
+
+def test_cached_load_sees_other_writers(datastore):
+    newgame(datastore, 'g')
+    datastore.load('g')
+    # As saved by another worker
+    datastore.collection.update_one(
+        {'game.name': 'g'},
+        {'$set': {'game.turn': 'black'}, '$inc': {'game.version': 1}})
+    board, game = datastore.load('g')
+    assert (game.turn, game.version) == ('black', 1)
+
+
+def test_cached_load_of_deleted_game(datastore):
+    newgame(datastore, 'g')
+    datastore.load('g')
+    datastore.collection.delete_one({'game.name': 'g'})
+    with pytest.raises(GameNotFoundError):
+        datastore.load('g')
+    assert datastore._cached('g') is None